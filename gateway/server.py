@@ -19,6 +19,15 @@ import fire_service_pb2
 import fire_service_pb2_grpc
 
 
+# Query response encodings a client can pick with 'response-compression' metadata
+RESPONSE_COMPRESSION = {
+    'gzip': grpc.Compression.Gzip,
+    'deflate': grpc.Compression.Deflate,
+    'none': grpc.Compression.NoCompression,
+}
+DEFAULT_RESPONSE_COMPRESSION = 'gzip'
+
+
 class FireQueryServiceImpl(fire_service_pb2_grpc.FireQueryServiceServicer):
     """Implementation of FireQueryService for Process A (Gateway)"""
     
@@ -48,6 +57,9 @@ class FireQueryServiceImpl(fire_service_pb2_grpc.FireQueryServiceServicer):
         print(f"  Parameters: {list(request.filter.parameters)}")
         print(f"  Chunk size: {request.max_results_per_chunk}")
         
+        # Compress the response stream (measurement records compress well)
+        context.set_compression(self._response_compression(context))
+        
         # Register request
         with self.request_lock:
             self.active_requests[request_id] = {
@@ -185,6 +197,12 @@ class FireQueryServiceImpl(fire_service_pb2_grpc.FireQueryServiceServicer):
         
         return all_measurements
     
+    def _response_compression(self, context):
+        """Response encoding requested by the client, gzip by default"""
+        metadata = dict(context.invocation_metadata())
+        encoding = metadata.get('response-compression', DEFAULT_RESPONSE_COMPRESSION)
+        return RESPONSE_COMPRESSION.get(encoding, RESPONSE_COMPRESSION[DEFAULT_RESPONSE_COMPRESSION])
+    
     def CancelRequest(self, request, context):
         """Handle request cancellation"""
         request_id = request.request_id
@@ -4,64 +4,362 @@ Performance Testing Script for Fire Query System
 Tests various aspects of system performance on single computer
 """
 
-import grpc
-import sys
 import os
+import sys
+
+# Prefer the upb (C) protobuf backend; must be set before protobuf is imported
+os.environ.setdefault('PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION', 'upb')
+
+# gRPC core settings; must be set before grpc is imported. Nothing here forks,
+# so skip the fork handlers, and use the epoll1 poller on Linux.
+os.environ.setdefault('GRPC_ENABLE_FORK_SUPPORT', '0')
+if sys.platform.startswith('linux'):
+    os.environ.setdefault('GRPC_POLL_STRATEGY', 'epoll1')
+
+import grpc
+import grpc.aio
+import asyncio
 import time
 import json
 import random
+import argparse
 import threading
+import atexit
+import itertools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import statistics
 
-# Add proto directory to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'proto'))
+try:
+    import orjson  # Optional: much faster JSON encoding
+except ImportError:
+    orjson = None
+
+# Use generated stubs from PYTHONPATH if present, else the repo's proto directory
+try:
+    import fire_service_pb2
+    import fire_service_pb2_grpc
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'proto'))
+    import fire_service_pb2
+    import fire_service_pb2_grpc
+
+from google.protobuf.internal import api_implementation
+
+
+# Channel options shared by every benchmark channel
+CHANNEL_OPTIONS = [
+    ('grpc.max_receive_message_length', 256 * 1024 * 1024),  # 256MB for large chunks
+    ('grpc.max_send_message_length', 100 * 1024 * 1024),     # 100MB
+    # Streaming throughput tuning
+    ('grpc.http2.lookahead_bytes', 4 * 1024 * 1024),         # 4MB stream window
+    ('grpc.http2.bdp_probe', 1),
+    ('grpc.http2.min_time_between_pings_ms', 10000),
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.optimization_target', 'throughput'),
+]
+
+# The gateway picks the Query response encoding from this metadata value
+RESPONSE_COMPRESSION_NAMES = {
+    grpc.Compression.Gzip: 'gzip',
+    grpc.Compression.Deflate: 'deflate',
+    grpc.Compression.NoCompression: 'none',
+}
+
+
+def response_compression_metadata(compression):
+    """Call metadata asking the gateway to encode Query responses with compression"""
+    return (('response-compression', RESPONSE_COMPRESSION_NAMES[compression]),)
+
+
+# Process-wide channel cache (one connection per server address)
+_CHANNELS: Dict[str, grpc.Channel] = {}
+_CHANNELS_LOCK = threading.Lock()
+
+
+def get_channel(server_address: str) -> grpc.Channel:
+    """Return the shared channel for server_address, creating it on first use"""
+    with _CHANNELS_LOCK:
+        channel = _CHANNELS.get(server_address)
+        if channel is None:
+            channel = grpc.insecure_channel(server_address, options=CHANNEL_OPTIONS)
+            _CHANNELS[server_address] = channel
+        return channel
+
+
+def close_channels():
+    """Close all cached channels"""
+    with _CHANNELS_LOCK:
+        for channel in _CHANNELS.values():
+            channel.close()
+        _CHANNELS.clear()
+
+
+atexit.register(close_channels)
+
+# Progress line is only drawn on a terminal, at most once per interval (ns)
+PROGRESS_ENABLED = sys.stdout.isatty()
+PROGRESS_INTERVAL_NS = 100_000_000  # 100ms
+
+# Marks the end of a response stream on a receive queue
+_STREAM_END = object()
+
+# One receiver thread, reused across the sequential queries instead of spawned
+# per query. The executor creates it lazily, so run_all_tests starts it with
+# warm_up_receiver() before anything is measured.
+_RECEIVERS = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chunk-receiver')
+
+
+def warm_up_receiver():
+    """Start the receiver thread so no test pays for creating it"""
+    _RECEIVERS.submit(lambda: None).result()
+
+
+class ResultsLog:
+    """NDJSON file that per-test results are appended to as tests finish"""
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.context: Dict[str, Any] = {}  # Run context stamped on every record
+    
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.file = open(self.path, 'wb')
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+    
+    @contextmanager
+    def tagged(self, **context):
+        """Add context (suite, num_clients, ...) to every record written in the block"""
+        saved = self.context
+        self.context = {**saved, **context}
+        try:
+            yield self
+        finally:
+            self.context = saved
+    
+    def write(self, result: Dict[str, Any]):
+        record = {**self.context, **result}
+        if orjson is not None:
+            self.file.write(orjson.dumps(record))
+        else:
+            self.file.write(json.dumps(record).encode())
+        self.file.write(b"\n")
+        self.file.flush()  # Keep completed tests if the run is interrupted
+
+
+def log_context(results_log: Optional[ResultsLog], **context):
+    """results_log.tagged(**context), or a no-op when there is no results log"""
+    return results_log.tagged(**context) if results_log is not None else nullcontext()
+
+
+def make_query_template(query_filter):
+    """Build a reusable chunked QueryRequest for query_filter"""
+    return fire_service_pb2.QueryRequest(
+        filter=query_filter,
+        query_type="filter",
+        require_chunked=True
+    )
+
+
+# Query shapes used by the tests, built once and cloned per run
+SMALL_QUERY = make_query_template(fire_service_pb2.QueryFilter(
+    parameters=["PM2.5"],
+    min_aqi=0,
+    max_aqi=50
+))
+MEDIUM_QUERY = make_query_template(fire_service_pb2.QueryFilter(
+    parameters=["PM2.5", "PM10"],
+    min_aqi=0,
+    max_aqi=100
+))
+LARGE_QUERY = make_query_template(fire_service_pb2.QueryFilter(
+    parameters=["PM2.5", "PM10", "OZONE", "NO2", "SO2", "CO"],
+    min_aqi=0,
+    max_aqi=500
+))
+NO_FILTER_QUERY = make_query_template(fire_service_pb2.QueryFilter())
+
+# Trivial unary call used to open a connection before measuring
+WARMUP_REQUEST = fire_service_pb2.StatusRequest(request_id=0, action="status")
+
 
-import fire_service_pb2
-import fire_service_pb2_grpc
+class ChannelPool:
+    """Round-robin pool of asyncio channels, each on its own TCP connection"""
+    def __init__(self, server_address: str, size: int = 4):
+        self.server_address = server_address
+        self.channels = []
+        for i in range(size):
+            # A unique channel arg plus a local subchannel pool keeps gRPC from
+            # collapsing these channels onto one shared connection
+            options = CHANNEL_OPTIONS + [
+                ('grpc.channel_id', i),
+                ('grpc.use_local_subchannel_pool', 1),
+            ]
+            self.channels.append(grpc.aio.insecure_channel(server_address, options=options))
+        self._counter = itertools.count()
+    
+    def next_channel(self) -> grpc.aio.Channel:
+        return self.channels[next(self._counter) % len(self.channels)]
+    
+    async def warm_up(self):
+        """Connect every channel with one unary call so no test pays the handshake"""
+        for channel in self.channels:
+            stub = fire_service_pb2_grpc.FireQueryServiceStub(channel)
+            try:
+                await stub.GetStatus(WARMUP_REQUEST)
+            except grpc.RpcError as e:
+                print(f"  Warm-up failed: {e.code()}: {e.details()}")
+    
+    async def close(self):
+        for channel in self.channels:
+            await channel.close()
+
+
+class P2Quantile:
+    """Streaming quantile estimate in O(1) memory (Jain & Chlamtac P-squared)
+    
+    The first exact_limit samples are kept and the quantile is exact over
+    them; P-squared markers are seeded from that buffer only once it
+    overflows, so short streams (large chunk sizes) get an exact answer.
+    """
+    def __init__(self, p: float = 0.5, exact_limit: int = 256):
+        self.p = p
+        self.exact_limit = exact_limit
+        self.samples = []
+        self.heights = None
+        self.positions = None
+        self.desired = None
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+    
+    def add(self, x: float):
+        if self.heights is None:
+            self.samples.append(x)
+            if len(self.samples) > self.exact_limit:
+                self._seed_markers()
+            return
+        
+        q = self.heights
+        
+        # Find the cell containing x, widening the extremes if needed
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        
+        # Nudge the three middle markers toward their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+    
+    def _seed_markers(self):
+        """Switch from the exact buffer to P-squared markers placed on its order statistics"""
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+        self.desired = [last * f for f in (0, self.p / 2, self.p, (1 + self.p) / 2, 1)]
+        self.positions = [round(d) for d in self.desired]
+        self.heights = [ordered[n] for n in self.positions]
+        self.samples = []
+    
+    def value(self) -> float:
+        if self.heights is not None:
+            return self.heights[2]
+        if not self.samples:
+            return 0
+        if self.p == 0.5:
+            return statistics.median(self.samples)
+        # Linear interpolation between order statistics (matches median at p=0.5)
+        ordered = sorted(self.samples)
+        rank = (len(ordered) - 1) * self.p
+        lo = int(rank)
+        hi = min(lo + 1, len(ordered) - 1)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
 
 
+@dataclass(slots=True)
 class PerformanceMetrics:
-    """Track performance metrics for a query"""
-    def __init__(self, test_name: str):
-        self.test_name = test_name
-        self.start_time = None
-        self.first_chunk_time = None
-        self.end_time = None
-        self.chunk_times = []
-        self.total_measurements = 0
-        self.total_chunks = 0
-        self.errors = []
+    """Track performance metrics for a query (timestamps in perf_counter_ns)"""
+    test_name: str
+    start_time: Optional[int] = None
+    first_chunk_time: Optional[int] = None
+    end_time: Optional[int] = None
+    # Chunk interval aggregates (ns), updated online per chunk
+    last_chunk_time: Optional[int] = None
+    interval_count: int = 0
+    interval_mean: float = 0.0
+    interval_m2: float = 0.0
+    interval_median: P2Quantile = field(default_factory=P2Quantile)
+    total_measurements: int = 0
+    total_chunks: int = 0
+    last_progress_time: int = 0
+    errors: List[str] = field(default_factory=list)
     
     def start(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter_ns()
     
     def record_first_chunk(self):
         if self.first_chunk_time is None:
-            self.first_chunk_time = time.time()
+            self.first_chunk_time = time.perf_counter_ns()
     
     def record_chunk(self, chunk_number: int, measurements_count: int):
-        self.chunk_times.append(time.time())
+        now = time.perf_counter_ns()
+        if self.last_chunk_time is not None:
+            # Welford update of the interval mean/variance
+            dt = now - self.last_chunk_time
+            self.interval_count += 1
+            delta = dt - self.interval_mean
+            self.interval_mean += delta / self.interval_count
+            self.interval_m2 += delta * (dt - self.interval_mean)
+            self.interval_median.add(dt)
+        self.last_chunk_time = now
         self.total_chunks += 1
         self.total_measurements += measurements_count
     
     def finish(self):
-        self.end_time = time.time()
+        self.end_time = time.perf_counter_ns()
+    
+    def elapsed(self) -> float:
+        """Seconds between start and finish"""
+        return (self.end_time - self.start_time) / 1e9
     
     def get_results(self) -> Dict[str, Any]:
         """Calculate and return performance metrics"""
-        if not self.start_time or not self.end_time:
+        if self.start_time is None or self.end_time is None:
             return {"error": "Incomplete test"}
         
-        total_time = self.end_time - self.start_time
-        time_to_first_chunk = self.first_chunk_time - self.start_time if self.first_chunk_time else 0
+        total_time = self.elapsed()
+        time_to_first_chunk = (self.first_chunk_time - self.start_time) / 1e9 if self.first_chunk_time is not None else 0
         
-        # Calculate chunk delivery intervals
-        chunk_intervals = []
-        if len(self.chunk_times) > 1:
-            for i in range(1, len(self.chunk_times)):
-                chunk_intervals.append(self.chunk_times[i] - self.chunk_times[i-1])
+        # Chunk delivery intervals (seconds)
+        has_intervals = self.interval_count > 0
+        interval_stdev = (self.interval_m2 / (self.interval_count - 1)) ** 0.5 if self.interval_count > 1 else 0
         
         results = {
             "test_name": self.test_name,
@@ -70,144 +368,270 @@ class PerformanceMetrics:
             "total_measurements": self.total_measurements,
             "total_chunks": self.total_chunks,
             "throughput": round(self.total_measurements / total_time, 2) if total_time > 0 else 0,
-            "avg_chunk_time": round(statistics.mean(chunk_intervals), 4) if chunk_intervals else 0,
-            "median_chunk_time": round(statistics.median(chunk_intervals), 4) if chunk_intervals else 0,
+            "avg_chunk_time": round(self.interval_mean / 1e9, 4) if has_intervals else 0,
+            "median_chunk_time": round(self.interval_median.value() / 1e9, 4) if has_intervals else 0,
+            "stdev_chunk_time": round(interval_stdev / 1e9, 4),
             "errors": self.errors
         }
         
         return results
 
 
-def run_query_test(stub, test_name: str, query_filter, chunk_size: int) -> PerformanceMetrics:
+def build_query_request(template, chunk_size: int):
+    """Clone a query template with a random request id and the given chunk size"""
+    request = fire_service_pb2.QueryRequest()
+    request.CopyFrom(template)
+    request.request_id = random.randint(10000, 99999)
+    request.max_results_per_chunk = chunk_size
+    return request
+
+
+def handle_chunk(metrics: PerformanceMetrics, chunk):
+    """Record a received chunk and update the progress line"""
+    if metrics.first_chunk_time is None:
+        metrics.record_first_chunk()
+        print(f"  First chunk received: {(metrics.first_chunk_time - metrics.start_time) / 1e9:.3f}s")
+    
+    metrics.record_chunk(chunk.chunk_number, len(chunk.measurements))
+    
+    # Progress indicator (throttled so it stays out of the measured loop)
+    if PROGRESS_ENABLED and chunk.total_chunks > 0:
+        now = time.perf_counter_ns()
+        if chunk.is_last_chunk or now - metrics.last_progress_time >= PROGRESS_INTERVAL_NS:
+            metrics.last_progress_time = now
+            progress = (chunk.chunk_number + 1) / chunk.total_chunks * 100
+            print(f"\r  Progress: {progress:5.1f}% | Chunks: {chunk.chunk_number+1}/{chunk.total_chunks} | "
+                  f"Results: {metrics.total_measurements:,}", end='', flush=True)
+
+
+def receive_chunks(responses, chunk_queue: queue.SimpleQueue):
+    """Producer: drain a response stream into chunk_queue, ending with _STREAM_END
+    
+    Any exception is queued too, so the consumer re-raises it instead of
+    reporting a truncated stream as complete.
+    """
+    try:
+        for chunk in responses:
+            chunk_queue.put(chunk)
+    except BaseException as e:
+        chunk_queue.put(e)
+    finally:
+        chunk_queue.put(_STREAM_END)
+
+
+def run_query_test(stub, test_name: str, query_template, chunk_size: int,
+                   compression=grpc.Compression.Gzip,
+                   results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
     """Run a single query test and collect metrics"""
     print(f"\n{'='*60}")
     print(f"Running: {test_name}")
     print(f"{'='*60}")
     
     metrics = PerformanceMetrics(test_name)
-    request_id = random.randint(10000, 99999)
+    request = build_query_request(query_template, chunk_size)
     
-    request = fire_service_pb2.QueryRequest(
-        request_id=request_id,
-        filter=query_filter,
-        query_type="filter",
-        require_chunked=True,
-        max_results_per_chunk=chunk_size
-    )
+    # A receiver thread only reads the socket; bookkeeping happens here
+    chunk_queue = queue.SimpleQueue()
     
     metrics.start()
+    responses = stub.Query(request, metadata=response_compression_metadata(compression))
     
     try:
-        for chunk in stub.Query(request):
-            if metrics.first_chunk_time is None:
-                metrics.record_first_chunk()
-                print(f"  First chunk received: {time.time() - metrics.start_time:.3f}s")
-            
-            metrics.record_chunk(chunk.chunk_number, len(chunk.measurements))
-            
-            # Progress indicator
-            if chunk.total_chunks > 0:
-                progress = (chunk.chunk_number + 1) / chunk.total_chunks * 100
-                print(f"\r  Progress: {progress:5.1f}% | Chunks: {chunk.chunk_number+1}/{chunk.total_chunks} | "
-                      f"Results: {metrics.total_measurements:,}", end='', flush=True)
+        _RECEIVERS.submit(receive_chunks, responses, chunk_queue)
+        
+        while True:
+            chunk = chunk_queue.get()
+            if chunk is _STREAM_END:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            handle_chunk(metrics, chunk)
         
         print()  # New line after progress
         metrics.finish()
-        print(f"✓ Test completed in {metrics.end_time - metrics.start_time:.2f}s")
+        print(f"✓ Test completed in {metrics.elapsed():.2f}s")
         
     except grpc.RpcError as e:
         metrics.finish()
         metrics.errors.append(f"{e.code()}: {e.details()}")
         print(f"✗ Error: {e.code()}: {e.details()}")
+    finally:
+        # Releases the receiver thread if we leave early (e.g. Ctrl-C)
+        responses.cancel()
     
+    if results_log is not None:
+        results_log.write(metrics.get_results())
     return metrics
 
 
-def test_small_query(stub, chunk_size: int) -> PerformanceMetrics:
+async def run_query_test_async(stub, test_name: str, query_template, chunk_size: int,
+                               compression=grpc.Compression.Gzip,
+                               results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
+    """Run a single query test on a grpc.aio stub and collect metrics"""
+    print(f"\n{'='*60}")
+    print(f"Running: {test_name}")
+    print(f"{'='*60}")
+    
+    metrics = PerformanceMetrics(test_name)
+    request = build_query_request(query_template, chunk_size)
+    
+    metrics.start()
+    
+    try:
+        async for chunk in stub.Query(request, metadata=response_compression_metadata(compression)):
+            handle_chunk(metrics, chunk)
+        
+        print()  # New line after progress
+        metrics.finish()
+        print(f"✓ Test completed in {metrics.elapsed():.2f}s")
+        
+    except grpc.RpcError as e:
+        metrics.finish()
+        metrics.errors.append(f"{e.code()}: {e.details()}")
+        print(f"✗ Error: {e.code()}: {e.details()}")
+    
+    if results_log is not None:
+        results_log.write(metrics.get_results())
+    return metrics
+
+
+def test_small_query(stub, chunk_size: int, results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
     """Test: Small query (single parameter, narrow AQI range)"""
-    query_filter = fire_service_pb2.QueryFilter(
-        parameters=["PM2.5"],
-        min_aqi=0,
-        max_aqi=50
-    )
-    return run_query_test(stub, f"Small Query (chunk_size={chunk_size})", query_filter, chunk_size)
+    return run_query_test(stub, f"Small Query (chunk_size={chunk_size})", SMALL_QUERY, chunk_size,
+                          results_log=results_log)
 
 
-def test_medium_query(stub, chunk_size: int) -> PerformanceMetrics:
+def test_medium_query(stub, chunk_size: int, compression=grpc.Compression.Gzip,
+                      results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
     """Test: Medium query (2 parameters, moderate AQI range)"""
-    query_filter = fire_service_pb2.QueryFilter(
-        parameters=["PM2.5", "PM10"],
-        min_aqi=0,
-        max_aqi=100
-    )
-    return run_query_test(stub, f"Medium Query (chunk_size={chunk_size})", query_filter, chunk_size)
+    test_name = f"Medium Query (chunk_size={chunk_size})"
+    if compression != grpc.Compression.Gzip:
+        test_name = f"Medium Query (chunk_size={chunk_size}, compression={compression.name})"
+    return run_query_test(stub, test_name, MEDIUM_QUERY, chunk_size, compression, results_log)
 
 
-def test_large_query(stub, chunk_size: int) -> PerformanceMetrics:
+def test_large_query(stub, chunk_size: int, results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
     """Test: Large query (all parameters, wide AQI range)"""
-    query_filter = fire_service_pb2.QueryFilter(
-        parameters=["PM2.5", "PM10", "OZONE", "NO2", "SO2", "CO"],
-        min_aqi=0,
-        max_aqi=500
-    )
-    return run_query_test(stub, f"Large Query (chunk_size={chunk_size})", query_filter, chunk_size)
+    return run_query_test(stub, f"Large Query (chunk_size={chunk_size})", LARGE_QUERY, chunk_size,
+                          results_log=results_log)
 
 
-def test_no_filter_query(stub, chunk_size: int) -> PerformanceMetrics:
+def test_no_filter_query(stub, chunk_size: int, results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
     """Test: No filter (all data)"""
-    query_filter = fire_service_pb2.QueryFilter()
-    return run_query_test(stub, f"No Filter Query (chunk_size={chunk_size})", query_filter, chunk_size)
+    return run_query_test(stub, f"No Filter Query (chunk_size={chunk_size})", NO_FILTER_QUERY, chunk_size,
+                          results_log=results_log)
 
 
-def concurrent_query_worker(stub, test_name: str, query_filter, chunk_size: int, 
-                            results: List, worker_id: int):
-    """Worker function for concurrent query testing"""
-    metrics = run_query_test(stub, f"{test_name} (Worker {worker_id})", query_filter, chunk_size)
-    results.append(metrics)
+async def concurrent_query_worker(stub, test_name: str, query_template, chunk_size: int,
+                                  num_clients: int, worker_id: int,
+                                  results_log: Optional[ResultsLog] = None) -> PerformanceMetrics:
+    """Worker coroutine for concurrent query testing"""
+    return await run_query_test_async(stub, f"{test_name} ({num_clients} clients, Worker {worker_id})",
+                                      query_template, chunk_size, results_log=results_log)
 
 
-def test_concurrent_queries(server_address: str, num_clients: int, chunk_size: int) -> List[PerformanceMetrics]:
+async def test_concurrent_queries(pool: ChannelPool, num_clients: int, chunk_size: int,
+                                  results_log: Optional[ResultsLog] = None) -> List[PerformanceMetrics]:
     """Test concurrent queries from multiple clients"""
     print(f"\n{'='*60}")
     print(f"Concurrent Query Test: {num_clients} clients")
     print(f"{'='*60}")
     
-    # Medium query for concurrent testing
-    query_filter = fire_service_pb2.QueryFilter(
-        parameters=["PM2.5", "PM10"],
-        min_aqi=0,
-        max_aqi=100
-    )
+    start_time = time.perf_counter_ns()
     
-    results = []
-    threads = []
-    
-    start_time = time.time()
-    
-    for i in range(num_clients):
-        # Each client gets its own channel
-        channel = grpc.insecure_channel(server_address)
-        stub = fire_service_pb2_grpc.FireQueryServiceStub(channel)
-        
-        thread = threading.Thread(
-            target=concurrent_query_worker,
-            args=(stub, f"Concurrent Query", query_filter, chunk_size, results, i+1)
+    # Clients are spread round-robin across the pool's connections and
+    # multiplexed on this event loop
+    workers = [
+        concurrent_query_worker(
+            fire_service_pb2_grpc.FireQueryServiceStub(pool.next_channel()),
+            "Concurrent Query", MEDIUM_QUERY, chunk_size, num_clients, i+1, results_log
         )
-        threads.append(thread)
-        thread.start()
+        for i in range(num_clients)
+    ]
+    with log_context(results_log, num_clients=num_clients):
+        results = list(await asyncio.gather(*workers))
     
-    # Wait for all threads
-    for thread in threads:
-        thread.join()
-    
-    total_time = time.time() - start_time
+    total_time = (time.perf_counter_ns() - start_time) / 1e9
     print(f"\n✓ All {num_clients} concurrent queries completed in {total_time:.2f}s")
     
     return results
 
 
-def run_all_tests(server_address: str = "localhost:50051") -> Dict[str, Any]:
-    """Run all performance tests"""
+async def run_concurrent_tests(server_address: str, client_counts: List[int], chunk_size: int,
+                               results_log: Optional[ResultsLog] = None) -> Dict[int, List[PerformanceMetrics]]:
+    """Run the concurrent query test for each client count on one event loop"""
+    pool = ChannelPool(server_address)
+    results = {}
+    
+    try:
+        await pool.warm_up()
+        
+        for num_clients in client_counts:
+            print(f"\n--- Testing with {num_clients} concurrent client(s) ---")
+            results[num_clients] = await test_concurrent_queries(pool, num_clients, chunk_size, results_log)
+    finally:
+        await pool.close()
+    
+    return results
+
+
+def aggregate_concurrent_results(num_clients: int, concurrent_results: List[PerformanceMetrics],
+                                 include_results: bool = True) -> Dict[str, Any]:
+    """Aggregate one concurrent run in a single pass over its workers
+    
+    Set include_results to False when per-worker results are already in a
+    results log, to keep them out of the summary.
+    """
+    results = []
+    total_measurements = 0
+    total_elapsed_ns = 0
+    first_start = None
+    last_end = None
+    
+    for m in concurrent_results:
+        if include_results:
+            results.append(m.get_results())
+        total_measurements += m.total_measurements
+        total_elapsed_ns += m.end_time - m.start_time
+        if first_start is None or m.start_time < first_start:
+            first_start = m.start_time
+        if last_end is None or m.end_time > last_end:
+            last_end = m.end_time
+    
+    summary = {
+        "num_clients": num_clients,
+        "total_measurements": total_measurements,
+        "avg_time": total_elapsed_ns / len(concurrent_results) / 1e9 if concurrent_results else 0,
+        "total_time": (last_end - first_start) / 1e9 if concurrent_results else 0
+    }
+    if include_results:
+        summary["results"] = results
+    return summary
+
+
+# Default chunk size sweep for test suite 1
+DEFAULT_CHUNK_SIZES = [100, 1000, 10000, 25000]
+
+
+def run_all_tests(server_address: str = "localhost:50051",
+                  chunk_sizes: List[int] = None,
+                  results_log: str = None) -> Dict[str, Any]:
+    """Run all performance tests
+    
+    If results_log is given, each test's result is appended to that NDJSON
+    file as soon as it finishes, tagged with its suite (and num_clients for
+    concurrent runs), and the returned summaries leave out the
+    per-worker results of concurrent runs. Otherwise everything is returned.
+    """
+    if results_log is None:
+        return _run_all_tests(server_address, chunk_sizes, None)
+    
+    with ResultsLog(results_log) as log:
+        return _run_all_tests(server_address, chunk_sizes, log)
+
+
+def _run_all_tests(server_address: str, chunk_sizes: Optional[List[int]],
+                   results_log: Optional[ResultsLog]) -> Dict[str, Any]:
     print("\n" + "="*80)
     print("FIRE QUERY SYSTEM - PERFORMANCE TEST SUITE")
     print("="*80)
@@ -215,15 +639,23 @@ def run_all_tests(server_address: str = "localhost:50051") -> Dict[str, Any]:
     print(f"Start Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("="*80)
     
-    # Create channel
-    channel = grpc.insecure_channel(server_address)
-    stub = fire_service_pb2_grpc.FireQueryServiceStub(channel)
+    # Reuse the cached channel for all sequential tests
+    stub = fire_service_pb2_grpc.FireQueryServiceStub(get_channel(server_address))
+    
+    # Warm up the channel so the first test's time to first chunk
+    # does not include connection setup
+    try:
+        stub.GetStatus(WARMUP_REQUEST)
+    except grpc.RpcError as e:
+        print(f"Warm-up failed: {e.code()}: {e.details()}")
+    warm_up_receiver()
     
     all_results = {
         "metadata": {
             "server": server_address,
             "timestamp": datetime.now().isoformat(),
-            "deployment": "single_computer"
+            "deployment": "single_computer",
+            "results_log": results_log.path if results_log is not None else None
         },
         "tests": {}
     }
@@ -233,13 +665,14 @@ def run_all_tests(server_address: str = "localhost:50051") -> Dict[str, Any]:
     print("# TEST SUITE 1: Chunk Size Optimization")
     print("#"*80)
     
-    chunk_sizes = [100, 500, 1000, 5000]
+    chunk_sizes = chunk_sizes or DEFAULT_CHUNK_SIZES
     all_results["tests"]["chunk_size_comparison"] = []
     
-    for chunk_size in chunk_sizes:
-        print(f"\n--- Testing with chunk_size={chunk_size} ---")
-        metrics = test_medium_query(stub, chunk_size)
-        all_results["tests"]["chunk_size_comparison"].append(metrics.get_results())
+    with log_context(results_log, suite="chunk_size_comparison"):
+        for chunk_size in chunk_sizes:
+            print(f"\n--- Testing with chunk_size={chunk_size} ---")
+            metrics = test_medium_query(stub, chunk_size, results_log=results_log)
+            all_results["tests"]["chunk_size_comparison"].append(metrics.get_results())
     
     # Test 2: Query complexity
     print("\n" + "#"*80)
@@ -249,43 +682,51 @@ def run_all_tests(server_address: str = "localhost:50051") -> Dict[str, Any]:
     chunk_size = 1000  # Standard chunk size
     all_results["tests"]["query_complexity"] = []
     
-    # Small query
-    metrics = test_small_query(stub, chunk_size)
-    all_results["tests"]["query_complexity"].append(metrics.get_results())
-    
-    # Medium query
-    metrics = test_medium_query(stub, chunk_size)
-    all_results["tests"]["query_complexity"].append(metrics.get_results())
-    
-    # Large query
-    metrics = test_large_query(stub, chunk_size)
-    all_results["tests"]["query_complexity"].append(metrics.get_results())
-    
-    # No filter
-    metrics = test_no_filter_query(stub, chunk_size)
-    all_results["tests"]["query_complexity"].append(metrics.get_results())
+    with log_context(results_log, suite="query_complexity"):
+        # Small query
+        metrics = test_small_query(stub, chunk_size, results_log)
+        all_results["tests"]["query_complexity"].append(metrics.get_results())
+        
+        # Medium query
+        metrics = test_medium_query(stub, chunk_size, results_log=results_log)
+        all_results["tests"]["query_complexity"].append(metrics.get_results())
+        
+        # Large query
+        metrics = test_large_query(stub, chunk_size, results_log)
+        all_results["tests"]["query_complexity"].append(metrics.get_results())
+        
+        # No filter
+        metrics = test_no_filter_query(stub, chunk_size, results_log)
+        all_results["tests"]["query_complexity"].append(metrics.get_results())
     
     # Test 3: Concurrent clients
     print("\n" + "#"*80)
     print("# TEST SUITE 3: Concurrent Client Testing")
     print("#"*80)
     
-    channel.close()  # Close the main channel
-    
     all_results["tests"]["concurrent_clients"] = {}
+    with log_context(results_log, suite="concurrent_clients"):
+        concurrent_runs = asyncio.run(run_concurrent_tests(server_address, [1, 2, 5], 1000, results_log))
     
-    for num_clients in [1, 2, 5]:
-        print(f"\n--- Testing with {num_clients} concurrent client(s) ---")
-        concurrent_results = test_concurrent_queries(server_address, num_clients, 1000)
-        
-        # Aggregate results
-        all_results["tests"]["concurrent_clients"][f"{num_clients}_clients"] = {
-            "num_clients": num_clients,
-            "results": [m.get_results() for m in concurrent_results],
-            "total_measurements": sum(m.total_measurements for m in concurrent_results),
-            "avg_time": statistics.mean([m.end_time - m.start_time for m in concurrent_results]),
-            "total_time": max(m.end_time for m in concurrent_results) - min(m.start_time for m in concurrent_results)
-        }
+    for num_clients, concurrent_results in concurrent_runs.items():
+        all_results["tests"]["concurrent_clients"][f"{num_clients}_clients"] = \
+            aggregate_concurrent_results(num_clients, concurrent_results,
+                                         include_results=results_log is None)
+    
+    # Test 4: Compression
+    print("\n" + "#"*80)
+    print("# TEST SUITE 4: Compression")
+    print("#"*80)
+    
+    all_results["tests"]["compression_comparison"] = []
+    
+    for compression in [grpc.Compression.Gzip, grpc.Compression.NoCompression]:
+        print(f"\n--- Testing with compression={compression.name} ---")
+        with log_context(results_log, suite="compression_comparison", compression=compression.name):
+            metrics = test_medium_query(stub, 1000, compression, results_log)
+        result = metrics.get_results()
+        result["compression"] = compression.name
+        all_results["tests"]["compression_comparison"].append(result)
     
     print("\n" + "="*80)
     print("ALL TESTS COMPLETED")
@@ -298,8 +739,12 @@ def save_results(results: Dict[str, Any], output_file: str):
     """Save results to JSON file"""
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    with open(output_file, 'w') as f:
-        json.dump(results, f, indent=2)
+    if orjson is not None:
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    else:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
     
     print(f"\n✓ Results saved to: {output_file}")
 
@@ -339,27 +784,100 @@ def print_summary(results: Dict[str, Any]):
               f"Avg {data['avg_time']:6.2f}s | "
               f"Total measurements: {data['total_measurements']:,}")
     
+    # Compression
+    print("\n4. Compression:")
+    print("-" * 60)
+    for test in results["tests"].get("compression_comparison", []):
+        print(f"  {test['compression']:13}: "
+              f"{test['total_time']:6.2f}s | "
+              f"{test['throughput']:8.0f} measurements/s")
+    
     print("\n" + "="*80)
 
 
+def parse_chunk_sizes(value: str) -> List[int]:
+    """argparse type for --chunk-sizes, e.g. 100,1000,10000"""
+    try:
+        sizes = [int(size) for size in value.split(',') if size.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid chunk size list: {value!r}")
+    if not sizes or any(size <= 0 for size in sizes):
+        raise argparse.ArgumentTypeError(f"chunk sizes must be positive integers: {value!r}")
+    return sizes
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """argparse type for --pin-cpus, e.g. 2,3 or 2-5"""
+    cpus = set()
+    try:
+        for part in value.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                low, high = part.split('-', 1)
+                cpus.update(range(int(low), int(high) + 1))
+            else:
+                cpus.add(int(part))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid CPU list: {value!r}")
+    if not cpus or min(cpus) < 0:
+        raise argparse.ArgumentTypeError(f"CPU list must name non-negative CPUs: {value!r}")
+    return sorted(cpus)
+
+
+def pin_cpus(cpus: List[int]):
+    """Pin the benchmark to the given CPUs (Linux only)
+    
+    Called before any channel or receiver thread exists, so gRPC's threads
+    and the receiver pool inherit the mask. Pin the servers to other cores,
+    e.g. `taskset -c 0,1 python server.py ../configs/process_a.json`.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        print("Warning: CPU pinning is not supported on this platform; ignoring --pin-cpus")
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        print(f"Warning: could not pin to CPUs {cpus}: {e}")
+        return
+    print(f"Pinned benchmark to CPUs: {sorted(os.sched_getaffinity(0))}")
+
+
 def main():
     """Main function"""
-    import argparse
-    
     parser = argparse.ArgumentParser(description='Performance testing for Fire Query System')
     parser.add_argument('--server', default='localhost:50051', help='Server address')
     parser.add_argument('--output', default='results/single_computer.json', help='Output file for results')
+    parser.add_argument('--results-log', default=None,
+                        help='NDJSON file for per-test results (default: output path with .ndjson)')
+    parser.add_argument('--chunk-sizes', type=parse_chunk_sizes, default=None,
+                        help=f"Comma-separated chunk sizes for the sweep "
+                             f"(default: {','.join(map(str, DEFAULT_CHUNK_SIZES))})")
+    parser.add_argument('--pin-cpus', type=parse_cpu_list, default=None,
+                        help='CPUs to pin the benchmark to, e.g. 2,3 or 2-3 (Linux only); '
+                             'pin the servers to different cores with taskset')
     args = parser.parse_args()
     
+    results_log = args.results_log or os.path.splitext(args.output)[0] + '.ndjson'
+    
+    if args.pin_cpus:
+        pin_cpus(args.pin_cpus)
+    
+    if api_implementation.Type() == 'python':
+        print("Warning: protobuf is using the pure-Python backend; "
+              "chunk parsing will be slow (install protobuf>=4.21 for upb)")
+    
     try:
-        # Run all tests
-        results = run_all_tests(args.server)
+        # Run all tests, logging each result as it completes
+        results = run_all_tests(args.server, args.chunk_sizes, results_log)
         
         # Print summary
         print_summary(results)
         
         # Save results
         save_results(results, args.output)
+        print(f"✓ Per-test results saved to: {results_log}")
         
         print("\n✓ Performance testing complete!")
         